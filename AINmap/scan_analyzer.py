@@ -9,19 +9,44 @@ Nmap扫描与Ollama AI分析工具
 import subprocess
 import sys
 import os
+import json
+import ipaddress
+import threading
+import time
+import hashlib
+import shelve
+import logging
+import argparse
 import ollama
-from xml.etree import ElementTree as ET
+from lxml import etree as ET
 
-# 配置Ollama模型
-OLLAMA_MODEL = 'qwen3:8b'
+log = logging.getLogger(__name__)
 
-# AI分析提示模板
-ANALYSIS_PROMPT = """你是一名顶级的网络安全分析专家。你的任务是分析以下 Nmap 扫描的 XML 输出数据，并生成一份专业的安全评估报告。
+# 配置Ollama模型，默认使用Q4_K_M量化版本，可通过环境变量覆盖
+OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'qwen3:8b-q4_K_M')
+# 按预期提示长度设置上下文窗口，避免默认2048截断扫描结果，也避免过大的KV缓存占用显存
+OLLAMA_OPTIONS = {'num_ctx': 8192, 'num_batch': 512}
+
+# Nmap扫描速率配置，可通过环境变量覆盖
+NMAP_MIN_RATE = os.environ.get('NMAP_MIN_RATE', '1000')
+NMAP_MAX_RETRIES = os.environ.get('NMAP_MAX_RETRIES', '2')
+# 每个目标的扫描超时时间(秒)
+NMAP_TIMEOUT_PER_TARGET = int(os.environ.get('NMAP_TIMEOUT_PER_TARGET', '180'))
 
-Nmap XML 输出数据如下：
-{nmap_xml_output}
+# Ollama响应缓存文件，相同模型和提示直接复用已生成的报告
+CACHE_FILE = 'ollama_cache.db'
 
-请根据以上数据，生成一份 Markdown 格式的详细报告，必须包含以下部分：
+# 发送给LLM的每段NSE脚本输出的最大长度
+SCRIPT_OUTPUT_LIMIT = 500
+
+# 报告文件名中需要替换的字符（路径分隔符、IPv6冒号及通配符）
+FILENAME_TRANSLATION = str.maketrans({'/': '_', '\\': '_', ':': '_', '*': '_', '?': '_'})
+
+# AI分析提示模板
+# 固定的说明部分放在前面、扫描数据放在最后，使各目标的提示前缀保持一致，便于Ollama复用KV缓存
+ANALYSIS_PROMPT = """你是一名顶级的网络安全分析专家。你的任务是分析文末给出的 Nmap 扫描结果（已从 XML 提取为 JSON 摘要），并生成一份专业的安全评估报告。
+
+请生成一份 Markdown 格式的详细报告，必须包含以下部分：
 
 ### 1. 摘要 (Executive Summary)
 对目标的整体安全状况进行高度概括的总结，点出最关键的发现。
@@ -38,7 +63,10 @@ Nmap XML 输出数据如下：
 ### 4. 修复建议 (Remediation Steps)
 - 提供具体、可操作的修复建议来解决上述发现的每一个风险。
 - 建议应按优先级排序（从最高风险开始）。
-- 示例：更新软件版本、应用安全补丁、关闭不必要的端口、加强防火墙规则等。"""
+- 示例：更新软件版本、应用安全补丁、关闭不必要的端口、加强防火墙规则等。
+
+Nmap 扫描结果如下：
+{nmap_summary}"""
 
 
 def check_nmap_installed():
@@ -53,45 +81,184 @@ def check_nmap_installed():
         return False
 
 
-def run_nmap_scan(target):
-    """对目标执行Nmap扫描并返回XML输出"""
+def iter_nmap_hosts(targets):
+    """在一次Nmap调用中扫描所有目标，直接从Nmap输出流中逐个产出<host>元素"""
+    # 使用全面扫描模式(-A)并以XML格式输出结果(-oX -)，所有目标共用一次进程启动和NSE初始化
+    # -T4/--min-rate/--max-retries 让Nmap保持发包速率，减少空闲等待
+    cmd = ['nmap', '-A', '-T4', '--min-rate', NMAP_MIN_RATE, '--max-retries', NMAP_MAX_RETRIES,
+           '-oX', '-', *targets]
+    timeout = NMAP_TIMEOUT_PER_TARGET * len(targets)
+    timed_out = threading.Event()
+    
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        def kill_on_timeout():
+            timed_out.set()
+            proc.kill()
+        
+        # 只统计等待Nmap输出的时间，调用方处理主机（如Ollama生成报告）期间暂停计时
+        remaining = timeout
+        timer = threading.Timer(remaining, kill_on_timeout)
+        timer.start()
+        started = time.monotonic()
+        try:
+            for _, host in ET.iterparse(proc.stdout, events=('end',), tag='host'):
+                timer.cancel()
+                remaining -= time.monotonic() - started
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug(ET.tostring(host, encoding='unicode'))
+                yield host
+                # 释放已处理的主机节点，使内存占用与扫描规模无关
+                host.clear()
+                while host.getprevious() is not None:
+                    del host.getparent()[0]
+                timer = threading.Timer(remaining, kill_on_timeout)
+                timer.start()
+                started = time.monotonic()
+        except ET.XMLSyntaxError:
+            # 超时被终止或Nmap异常退出时输出会被截断，优先报告真正的原因
+            proc.wait()
+            if timed_out.is_set():
+                raise subprocess.TimeoutExpired(cmd, timeout) from None
+            if proc.returncode:
+                raise subprocess.CalledProcessError(proc.returncode, cmd) from None
+            raise
+        except BaseException:
+            proc.kill()
+            raise
+        finally:
+            timer.cancel()
+    
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def get_host_label(host):
+    """获取主机的名称，优先使用targets.txt中填写的主机名，其次使用IP地址"""
+    hostname = host.find("hostnames/hostname[@type='user']")
+    if hostname is not None:
+        return hostname.get('name')
+    address = host.find('address')
+    return address.get('addr') if address is not None else 'unknown'
+
+
+def get_host_names(host):
+    """获取主机的所有地址和主机名，用于与targets.txt中的目标对应"""
+    names = {address.get('addr') for address in host.findall('address')}
+    names.update(hostname.get('name') for hostname in host.findall('hostnames/hostname'))
+    return names
+
+
+def target_has_results(target, seen_names):
+    """判断目标是否在扫描结果中出现，网段目标只要有任一主机出现即视为有结果"""
+    if target in seen_names:
+        return True
     try:
-        # 使用全面扫描模式(-A)并以XML格式输出结果(-oX -)
-        result = subprocess.run(['nmap', '-A', '-oX', '-', target], 
-                               capture_output=True, 
-                               text=True, 
-                               check=True,
-                               timeout=300)  # 5分钟超时
-        return result.stdout
-    except subprocess.CalledProcessError as e:
-        print(f"Nmap扫描失败 {target}: {e}")
-        return None
-    except subprocess.TimeoutExpired:
-        print(f"Nmap扫描超时 {target}")
-        return None
-    except Exception as e:
-        print(f"执行Nmap扫描时出错 {target}: {e}")
-        return None
+        network = ipaddress.ip_network(target, strict=False)
+    except ValueError:
+        return False
+    for name in seen_names:
+        try:
+            if ipaddress.ip_address(name) in network:
+                return True
+        except ValueError:
+            continue
+    return False
+
 
+def summarize_scripts(parent):
+    """提取NSE脚本的id和输出，输出截断到SCRIPT_OUTPUT_LIMIT个字符"""
+    return [
+        {'id': script.get('id'), 'output': script.get('output', '').strip()[:SCRIPT_OUTPUT_LIMIT]}
+        for script in parent.findall('script')
+    ]
 
-def analyze_with_ollama(xml_output, target):
-    """将Nmap XML输出发送给Ollama进行分析"""
+
+def summarize_host(host):
+    """将单个<host>元素提取为精简的JSON摘要，减少发送给LLM的token数量"""
+    address = host.find('address')
+    status = host.find('status')
+    osmatch = host.find('os/osmatch')  # Nmap按准确度排序，第一个即最佳匹配
+    ports = []
+    for port in host.findall('ports/port'):
+        state = port.find('state')
+        service = port.find('service')
+        entry = {
+            'port': port.get('portid'),
+            'proto': port.get('protocol'),
+            'state': state.get('state') if state is not None else '',
+            'service': service.get('name', '') if service is not None else '',
+            'product': service.get('product', '') if service is not None else '',
+            'version': service.get('version', '') if service is not None else '',
+            'extrainfo': service.get('extrainfo', '') if service is not None else '',
+        }
+        scripts = summarize_scripts(port)
+        if scripts:
+            entry['scripts'] = scripts
+        ports.append(entry)
+    summary = {
+        'host': address.get('addr') if address is not None else '',
+        'status': status.get('state') if status is not None else '',
+        'os': osmatch.get('name') if osmatch is not None else '',
+        'ports': ports,
+    }
+    hostscript = host.find('hostscript')
+    if hostscript is not None:
+        summary['scripts'] = summarize_scripts(hostscript)
+    return json.dumps(summary, ensure_ascii=False, separators=(',', ':'))
+
+
+def generate_report(prompt, filename):
+    """调用Ollama生成报告并流式写入文件，相同模型和提示的结果从本地缓存读取"""
+    options = json.dumps(OLLAMA_OPTIONS, sort_keys=True)
+    key = hashlib.sha256(f"{OLLAMA_MODEL}\x00{options}\x00{prompt}".encode('utf-8')).hexdigest()
+    with shelve.open(CACHE_FILE) as cache:
+        report = cache.get(key)
+    
+    cached = report is not None
+    # 先写入临时文件，生成完成后再替换正式报告，避免中途失败时留下不完整的报告覆盖旧报告
+    part_file = filename + '.part'
+    try:
+        # 以二进制方式写入并使用64KB缓冲，减少系统调用且省去文本模式的换行转换
+        with open(part_file, 'wb', buffering=1 << 16) as f:
+            if cached:
+                print("命中缓存，跳过Ollama调用")
+                f.write(report.encode('utf-8'))
+            else:
+                # 以流式方式请求Ollama，边生成边写入报告文件
+                parts = []
+                for chunk in ollama.generate(model=OLLAMA_MODEL, prompt=prompt,
+                                             options=OLLAMA_OPTIONS, stream=True):
+                    text = chunk['response']
+                    parts.append(text)
+                    f.write(text.encode('utf-8'))
+                report = ''.join(parts)
+        os.replace(part_file, filename)
+    except BaseException:
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        raise
+    
+    if not cached:
+        log.debug(report)
+        with shelve.open(CACHE_FILE) as cache:
+            cache[key] = report
+    return report
+
+
+def analyze_with_ollama(nmap_summary, target):
+    """将Nmap扫描摘要发送给Ollama进行分析"""
     try:
         # 构建提示
-        prompt = ANALYSIS_PROMPT.format(nmap_xml_output=xml_output)
-        print(prompt)
-        # 发送请求到Ollama
-        response = ollama.generate(model=OLLAMA_MODEL, prompt=prompt)
-        print(response)
-        # 提取生成的报告
-        report = response['response']
+        prompt = ANALYSIS_PROMPT.format(nmap_summary=nmap_summary)
+        log.debug(prompt)
         
         # 生成报告文件名
-        filename = f"report_{target.replace('/', '_').replace('\\', '_')}.md"
+        filename = f"report_{target.translate(FILENAME_TRANSLATION)}.md"
         
-        # 保存报告
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(report)
+        # 生成并保存报告
+        generate_report(prompt, filename)
         
         print(f"已生成报告: {filename}")
         return True
@@ -102,6 +269,11 @@ def analyze_with_ollama(xml_output, target):
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description='Nmap扫描与Ollama AI分析工具')
+    parser.add_argument('-v', '--verbose', action='store_true', help='输出Nmap XML、提示词和模型响应等调试信息')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(message)s')
+    
     # 检查nmap是否已安装
     if not check_nmap_installed():
         print("错误: 未找到nmap，请先安装nmap。")
@@ -125,30 +297,37 @@ def main():
         print("targets.txt文件中没有找到有效的扫描目标。")
         sys.exit(1)
     
-    # 循环处理所有目标
+    # 一次Nmap调用扫描所有目标，边扫描边按<host>拆分结果，逐个主机进行分析
+    print(f"正在扫描 {len(targets)} 个目标: {' '.join(targets)}")
+    seen_names = set()
+    try:
+        for host in iter_nmap_hosts(targets):
+            target = get_host_label(host)
+            seen_names.update(get_host_names(host))
+            nmap_summary = summarize_host(host)
+            
+            # 使用Ollama进行分析
+            print(f"正在分析目标: {target}")
+            if not analyze_with_ollama(nmap_summary, target):
+                print(f"分析目标 {target} 失败。")
+                continue
+    except subprocess.CalledProcessError as e:
+        print(f"Nmap扫描失败: {e}")
+        sys.exit(1)
+    except subprocess.TimeoutExpired:
+        print("Nmap扫描超时")
+        sys.exit(1)
+    except ET.XMLSyntaxError:
+        print("Nmap输出不是有效的XML格式。")
+        sys.exit(1)
+    except Exception as e:
+        print(f"执行Nmap扫描时出错: {e}")
+        sys.exit(1)
+    
+    # 主机离线或无法解析的目标不会出现在Nmap输出中，逐一提示
     for target in targets:
-        print(f"正在扫描目标: {target}")
-        
-        # 执行Nmap扫描
-        xml_output = run_nmap_scan(target)
-        print(xml_output)
-        # 检查扫描是否成功
-        if xml_output is None:
-            print(f"跳过目标 {target} 的分析，因为扫描失败。")
-            continue
-        
-        # 验证XML输出是否有效
-        try:
-            ET.fromstring(xml_output)
-        except ET.ParseError:
-            print(f"目标 {target} 的Nmap输出不是有效的XML格式。")
-            continue
-        
-        # 使用Ollama进行分析
-        print(f"正在分析目标: {target}")
-        if not analyze_with_ollama(xml_output, target):
-            print(f"分析目标 {target} 失败。")
-            continue
+        if not target_has_results(target, seen_names):
+            print(f"跳过目标 {target}（无扫描结果）")
     
     print("所有目标扫描和分析完成。")
 
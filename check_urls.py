@@ -1,21 +1,30 @@
+import asyncio
 import csv
-import requests
+import sys
 import time
-from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import aiohttp
 from tqdm import tqdm
-import warnings
-import subprocess
+import socket
+from functools import lru_cache
 
-warnings.filterwarnings('ignore', category=requests.packages.urllib3.exceptions.InsecureRequestWarning)
+# 同时进行的URL检查数量上限，同时作为连接池大小
+MAX_CONCURRENCY = 256
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=10)
 
-def check_url(url):
+async def check_url(session, url):
     try:
         # 分离网络检测和HTTP检测
-        parsed = requests.utils.urlparse(url)
+        parsed = urlparse(url)
         host = parsed.hostname or url.split('//')[-1].split(':')[0]
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
         
         # 网络层检测
-        ping_ok = check_ping(host)
+        ping_ok, unreachable = await check_ping(host, port)
+        # 域名无法解析或所有地址都拒绝连接时HTTP请求必然失败，直接返回以免等待超时；
+        # 探测超时的主机仍可能在HTTP超时内响应，继续进行HTTP检测
+        if unreachable:
+            return [url, '否', 'N/A', 0, '', '']
         
         # 应用层检测
         http_ok = False
@@ -23,17 +32,17 @@ def check_url(url):
         start_time = time.time()
         redirect_url = ''
         try:
-            response = requests.get(url, timeout=10, verify=False, allow_redirects=False)
-            status_code = response.status_code
-            http_ok = 200 <= status_code < 500
-            # 处理302重定向
-            redirect_url = response.headers.get('Location', '') if status_code == 302 else ''
+            async with session.get(url, timeout=HTTP_TIMEOUT, ssl=False, allow_redirects=False) as response:
+                status_code = response.status
+                http_ok = 200 <= status_code < 500
+                # 处理302重定向
+                redirect_url = response.headers.get('Location', '') if status_code == 302 else ''
             # 访问重定向地址并获取状态码
             redirect_status_code = ''
             if redirect_url:
                 try:
-                    redirect_response = requests.get(redirect_url, timeout=10, verify=False, allow_redirects=False)
-                    redirect_status_code = redirect_response.status_code
+                    async with session.get(redirect_url, timeout=HTTP_TIMEOUT, ssl=False, allow_redirects=False) as redirect_response:
+                        redirect_status_code = redirect_response.status
                 except Exception:
                     redirect_status_code = '访问失败'
             elapsed = round((time.time()-start_time)*1000, 2)
@@ -52,15 +61,51 @@ def check_url(url):
     except Exception as e:
         return [url, '否', f"解析失败: {str(e)}", 0, '', '']
 
-def check_ping(host):
+@lru_cache(maxsize=1024)
+def _resolve(host, port):
+    """解析TCP探测的目标地址，同一主机只解析一次（解析失败会抛出异常，不会被缓存）"""
+    return socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+
+async def check_ping(host, port=443):
+    """使用TCP连接探测代替ping子进程，无需ICMP权限
+    
+    返回 (是否可达, 是否确定不可达)，只有解析失败或所有地址都拒绝连接才算确定不可达
+    """
+    loop = asyncio.get_running_loop()
     try:
-        result = subprocess.run(['ping', '-n', '1', '-w', '1000', host],
-                              stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE,
-                              text=True)
-        return result.returncode == 0
-    except Exception:
-        return False
+        # 先完成DNS解析，1秒超时只用于TCP连接，避免解析线程池排队时把可达主机误判为不可达
+        addrinfo = await loop.run_in_executor(None, _resolve, host, port)
+    except socket.gaierror:
+        return False, True
+    except OSError:
+        return False, False
+    
+    # 依次尝试解析出的每个地址，避免AAAA记录不可用等情况导致误判
+    all_refused = True
+    for *_, address in addrinfo:
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(address[0], address[1]), timeout=1)
+            writer.close()
+            return True, False
+        except ConnectionRefusedError:
+            continue
+        except (OSError, asyncio.TimeoutError):
+            all_refused = False
+    return False, all_refused
+
+async def run_all(urls, handle_result):
+    """在单个事件循环中并发检查所有URL，每完成一个即以(输入序号, 结果)回调handle_result"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    # HTTP请求使用连接器自带的DNS缓存，并在整个运行期间保留解析结果
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENCY, ttl_dns_cache=None)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def bounded_check(index, url):
+            async with semaphore:
+                return index, await check_url(session, url)
+        
+        tasks = [bounded_check(index, url) for index, url in enumerate(urls)]
+        for future in tqdm(asyncio.as_completed(tasks), total=len(urls), desc="检查进度"):
+            handle_result(*await future)
 
 def main():
     start_time = time.time()
@@ -72,37 +117,38 @@ def main():
         
         writer = csv.writer(outfile)
         # 写入表头
-        writer.writerow(["网址", "ping是否可达", "http响应状态码", "响应时间", "重定向地址", "重定向状态码"])
+        output_headers = ["网址", "ping是否可达", "http响应状态码", "响应时间", "重定向地址", "重定向状态码"]
+        writer.writerow(output_headers)
         
         # 使用csv.reader正确读取URL，支持包含逗号的URL
         reader = csv.reader(infile)
         urls = [row[0].strip() for row in reader if row and row[0].strip()]
         total_urls = len(urls)
         
-        # 读取每个URL并显示进度
-        for index, url in enumerate(urls, start=1):
-            print(f"正在检查第{index}/{total_urls}个URL: {url}")
-            result = check_url(url)
-            writer.writerow(result)
+        # 并发检查URL并显示进度
+        # 结果按输入顺序保存在内存中，全部完成后再写入output.csv，并供后续统计和打印使用
+        results = [None] * total_urls
+        # 打印表格用的表头，列宽在生成结果时逐行更新
+        headers = ['网址', 'ping是否可达', '状态码/错误', '响应时间(ms)', '重定向地址', '重定向状态码']
+        col_widths = [len(header) for header in headers]
+        
+        def handle_result(index, result):
+            results[index] = result
+            for i, cell in enumerate(result):
+                col_widths[i] = max(col_widths[i], len(str(cell)))
             ping_status = "可达" if result[1] == "是" else "不可达"
-            print(f"已完成第{index}/{total_urls}个URL检查: ping{ping_status}")
+            tqdm.write(f"已完成URL检查: {result[0]} ping{ping_status}")
+        
+        asyncio.run(run_all(urls, handle_result))
+        writer.writerows(results)
     
     # 统计和报告部分
     if total_urls == 0:
         print("没有URL需要检查。")
         return
     
-    ping_success_count = 0
-    total_response_time = 0.0
-    response_count = 0
-    
-    with open(output_file, 'r', encoding='utf-8') as report_file:
-        reader = csv.reader(report_file)
-        next(reader)  # 跳过表头
-        for row in reader:
-            # 统计ping成功数
-            if len(row) >= 2 and row[1] == "是":
-                ping_success_count += 1
+    # 统计ping成功数
+    ping_success_count = sum(1 for result in results if result[1] == "是")
     
     # 计算总耗时
     total_time = time.time() - start_time
@@ -116,45 +162,22 @@ def main():
     
     # 打印表格形式的结果
     print("\n===== 检查结果详情 =====")
-    with open(output_file, 'r', encoding='utf-8') as report_file:
-        reader = csv.reader(report_file)
-        rows = list(reader)
-        if not rows:
-            print("没有检查结果数据。")
-            return
-        
-        headers = rows[0]
-        headers = ['网址', 'ping是否可达', '状态码/错误', '响应时间(ms)', '重定向地址', '重定向状态码']
-        data = []
-        for row in rows[1:]:
-            # 确保每行有5列，多余截断，不足补空
-            fixed_row = row[:6] + [''] * max(0, 6 - len(row))
-            data.append(fixed_row)
-        
-        # 计算每列最大宽度
-        # 计算列宽时同时考虑表头和数据
-        # 改进后的列宽计算逻辑
-        headers = ['网址', 'ping是否可达', '状态码/错误', '响应时间(ms)', '重定向地址', '重定向状态码']
-        col_widths = [
-            max(len(str(header)), *[len(str(row[i])) for row in data]) 
-            for i, header in enumerate(headers)
-        ] if data else [15, 8, 15, 12, 30, 15]  # 为6列设置默认列宽
+    # 打印表头
+    header_line = " | ".join(f"{str(header).ljust(width)}" for header, width in zip(headers, col_widths))
+    print(header_line)
     
-        # 打印表头
-        header_line = " | ".join(f"{str(header).ljust(width)}" for header, width in zip(headers, col_widths))
-        print(header_line)
-        
-        # 打印分隔线
-        separator_line = "-+".join("-" * col_width for col_width in col_widths)
-        print(separator_line)
-        
-        # 打印数据行
-        for row in data:
-            row_line = " | ".join(f"{str(cell).ljust(width)}" for cell, width in zip(row, col_widths))
-            print(row_line)
+    # 打印分隔线
+    separator_line = "-+".join("-" * col_width for col_width in col_widths)
+    print(separator_line)
+    
+    # 打印数据行
+    for row in results:
+        row_line = " | ".join(f"{str(cell).ljust(width)}" for cell, width in zip(row, col_widths))
+        print(row_line)
     print('\n完整检测结果：')
-    with open('output.csv', 'r', encoding='utf-8') as f:
-        print(f.read())
+    console_writer = csv.writer(sys.stdout, lineterminator='\n')
+    console_writer.writerow(output_headers)
+    console_writer.writerows(results)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,5 +1,18 @@
 import ipaddress
 import random
+import bisect
+import socket
+import sys
+
+def format_ipv4(value):
+    """将整数形式的 IPv4 地址转换为点分十进制字符串，由 C 层的 inet_ntoa 完成格式化。"""
+    return socket.inet_ntoa(value.to_bytes(4, 'big'))
+
+
+def format_ipv6(value):
+    """将整数形式的 IPv6 地址转换为字符串。"""
+    return str(ipaddress.IPv6Address(value))
+
 
 def generate_ips(ip_ranges, num_ips):
     """
@@ -16,29 +29,64 @@ def generate_ips(ip_ranges, num_ips):
     if not 10 <= num_ips <= 5000:
         raise ValueError("IP 地址数量必须在 10 到 5000 之间。")
 
-    all_ips = []
+    # 只记录每个地址段可用主机的整数地址区间，不逐个生成地址字符串
+    intervals = []  # (IP 版本, 起始地址, 结束地址)
     for ip_range in ip_ranges:
         try:
             network = ipaddress.ip_network(ip_range)
-            # Exclude network and broadcast addresses
-            ips = [str(ip) for ip in network.hosts()]
-            all_ips.extend(ips)
         except ValueError as e:
             print(f"警告: 无效的 IP 地址段 '{ip_range}': {e}")
             continue  # Skip invalid IP ranges
 
-    if not all_ips:
+        # 与 network.hosts() 保持一致：/31、/32 使用全部地址，
+        # 其他 IPv4 段排除网络地址和广播地址，IPv6 段排除子网路由器任播地址
+        start = int(network.network_address)
+        end = int(network.broadcast_address)
+        if network.num_addresses > 2:
+            start += 1
+            if network.version == 4:
+                end -= 1
+        intervals.append((network.version, start, end))
+
+    # 合并重叠或相邻的区间，保证生成的地址不重复
+    merged = []
+    for version, start, end in sorted(intervals):
+        if merged and merged[-1][0] == version and start <= merged[-1][2] + 1:
+            merged[-1][2] = max(merged[-1][2], end)
+        else:
+            merged.append([version, start, end])
+
+    ranges = []  # (起始地址, 格式化函数)
+    offsets = []  # 各地址段在整体地址空间中的起始偏移
+    total_hosts = 0
+    for version, start, end in merged:
+        ranges.append((start, format_ipv4 if version == 4 else format_ipv6))
+        offsets.append(total_hosts)
+        total_hosts += end - start + 1
+
+    if not total_hosts:
         return ""  # No valid IPs to generate
 
-    if num_ips > len(all_ips):
-        print(f"警告: 请求的 IP 地址数量 ({num_ips}) 大于可用地址总数 ({len(all_ips)})。生成所有可用的唯一 IP 地址。")
-        num_ips = len(all_ips)
+    if num_ips > total_hosts:
+        print(f"警告: 请求的 IP 地址数量 ({num_ips}) 大于可用地址总数 ({total_hosts})。生成所有可用的唯一 IP 地址。")
+        num_ips = total_hosts
+
+    if total_hosts <= sys.maxsize:
+        sampled_offsets = random.sample(range(total_hosts), num_ips)
+    else:
+        # 大的 IPv6 段超出 range 的长度上限，改为随机抽取偏移并去重；
+        # 地址空间远大于 num_ips，几乎不会发生重复抽取
+        sampled_offsets = set()
+        while len(sampled_offsets) < num_ips:
+            sampled_offsets.add(random.randrange(total_hosts))
 
-    unique_ips = set()
-    while len(unique_ips) < num_ips:
-        unique_ips.add(random.choice(all_ips))
+    ips = []
+    for offset in sampled_offsets:
+        index = bisect.bisect_right(offsets, offset) - 1
+        start, format_ip = ranges[index]
+        ips.append(format_ip(start + offset - offsets[index]))
 
-    return ",".join(unique_ips)
+    return ",".join(ips)
 
 
 if __name__ == '__main__':